@@ -29,12 +29,14 @@ import six
 import vstruct
 import xlsxwriter
 import postgrok.schema_reader as schema_reader
+import postgrok.page_checksum as page_checksum
 
 
 
-def parsing_loop(file_to_parse, k, filename, output_dir, out_type):
+def parsing_loop(file_to_parse, k, filename, output_dir, out_type, verify_checksums=False):
     """Main function to read raw image/file
     1. Identify all pages/tables (find_tables function) in binary file provided (file_to_parse)
+       - If verify_checksums is set, only pages with a valid PostgreSQL page checksum are kept
     2. Begin main loop for carving rows from identified tables
        - Each table is made up of several pages, parse row pointers from each page (parse_pointers function)
        - Loop through the pointers for each page. Each Pointer is a list made up of three items:
@@ -57,7 +59,11 @@ def parsing_loop(file_to_parse, k, filename, output_dir, out_type):
     successful_carves = 0
 
     carved_tables = list()
-    all_tables = find_tables(file_to_parse)
+    if verify_checksums:
+        pages = page_checksum.verified_pages(file_to_parse, page_checksum.segment_block_offset(filename))
+        all_tables = find_tables(file_to_parse, pages)
+    else:
+        all_tables = find_tables(file_to_parse)
     for table in all_tables:
         table_rows = list()
         for page in table:
@@ -103,52 +109,63 @@ def parsing_loop(file_to_parse, k, filename, output_dir, out_type):
     do_output(better_carved_tables, k+"_"+filename, output_dir, out_type)
     sys.stdout.write(("\r++++++ Successful Row Carves: " + str(successful_carves)+ " / " + "Total Rows: " + str(total_row)) + " ++++++")
 
-def find_tables(file_to_parse):
+def find_tables(file_to_parse, pages=None):
     """Function to find all tables within an image/file
     1. Function of main parsing loop:
-       - Read a sector (512 bytes)
-       - Determine if section *looks* like a PostgreSQL table
-       - If the header check is successful, read 8192 bytes (size of postgresql page)
+       - Get the candidate pages, by default from the header check (header_checked_pages function),
+         or from the pages iterable if one is provided (ex: page_checksum.verified_pages)
        - Determine the amount of bytes between the current page, and the previous page.
           - sequential pages are likely going to be a part of the same Table (will be helpful for output)
     2. Append all of the tables identified to a new list, All_tables.
     3. Return All_Tables"""
 
-    current_pos = 0
-    start_pos = 0
     previous_table_pos = 0
     count = 0
     all_tables = list()
-    f = open(file_to_parse, 'rb')
     tables = list()
 
-    while True:
+    if pages is None:
+        pages = header_checked_pages(file_to_parse)
+
+    for current_pos, table_chunk in pages:
         if (count % 2000) == 0 and count != 0:
             print("++++++ Still working through file, successfully identified " + str(count) + " PostgreSQL pages ++++++")
+        row_numbers = read_header(table_chunk[:24])[0]
+        if current_pos-previous_table_pos == 8192 or current_pos-previous_table_pos == 0:
+            table = [table_chunk, row_numbers]
+            tables.append(table)
+            count += 1
+            previous_table_pos = current_pos
+        elif (current_pos-previous_table_pos) != 8192:
+            table = [table_chunk, row_numbers]
+            all_tables.append(tables)
+            tables = list()
+            count += 1
+            previous_table_pos = current_pos
+    all_tables.append(tables)
+    print("++++++ Finished finding tables. Found " + str(count) + " PostgreSQL pages in " + str(len(all_tables)) + " tables. Beginning row parsing... ++++++")
+    return all_tables
+
+def header_checked_pages(file_to_parse):
+    """Generator to find pages that *look* like PostgreSQL pages
+       - Read a sector (512 bytes)
+       - Determine if section *looks* like a PostgreSQL table
+       - If the header check is successful, read 8192 bytes (size of postgresql page)
+       - Yield the position and the page"""
+    current_pos = 0
+    f = open(file_to_parse, 'rb')
+
+    while True:
         sector = f.read(512)
         if not sector:
             break
         row_numbers, lower, start_of_rows, header_check = read_header(sector[:24])
         if header_check:
             f.seek(current_pos)
-            table_chunk = f.read(8192)
-            if current_pos-previous_table_pos == 8192 or current_pos-previous_table_pos == 0:
-                table = [table_chunk, row_numbers]
-                tables.append(table)
-                count += 1
-                previous_table_pos = current_pos
-            elif (current_pos-previous_table_pos) != 8192:
-                table = [table_chunk, row_numbers]
-                all_tables.append(tables)
-                tables = list()
-                count += 1
-                previous_table_pos = current_pos
+            yield current_pos, f.read(8192)
         current_pos = (current_pos + 8192)
         f.seek(current_pos)
     f.close()
-    all_tables.append(tables)
-    print("++++++ Finished finding tables. Found " + str(count) + " PostgreSQL pages in " + str(len(all_tables)) + " tables. Beginning row parsing... ++++++")
-    return all_tables
 
 def parse_row(table, length, offset, keyword, hoff, natts, bitmap):
     """function to handle parsing a row
@@ -400,6 +417,7 @@ def main():
     parser.add_argument('-k', '--keyword', action='store', help='Provide a keyword to search for in a PostGreSQL row, example: "Metasploit"')
     parser.add_argument('-t', '--output_type', action='store', help="Options include CSV or XLSX. XLSX output replaces non ascii chars with '?', CSV outputs everything, but formatting will be broken on rows containing line breaks. Default is CSV")
     parser.add_argument('-o', '--output', action='store', help="Provide an output directory, if no output directory is provided, output will be written to current directory")
+    parser.add_argument('-c', '--checksum', action='store_true', help="Only carve pages with a valid PostgreSQL page checksum. Far fewer false positives, but only works on clusters initialized with data checksums (initdb -k). Requires numpy")
 
     if len(sys.argv) == 1:
         parser.print_help()
@@ -420,6 +438,11 @@ def main():
     else:
         output_dir = os.curdir
 
+    verify_checksums = args.get('checksum', False)
+    if verify_checksums and page_checksum.numpy is None:
+        print("Checksum verification requires numpy, install it with: pip install numpy")
+        return 1
+
     if 'input' in args and args['input'] != None and os.path.isfile(args['input']):
         if "/" in args['input']:
             filename = args['input'].rsplit("/", 1)[-1]
@@ -433,7 +456,7 @@ def main():
             print("Based on size, this is not a valid table. The file should be at least 8192 bytes, " + filename + " " + "is: " + str(file_size) + " bytes")
         else:
             sys.stdout.write("\nReading from: " + filename+ "\n")
-            parsing_loop(args['input'], k, filename, output_dir, out_type)
+            parsing_loop(args['input'], k, filename, output_dir, out_type, verify_checksums)
 
     elif 'input' in args and args['input'] != None and not os.path.isfile(args['input']):
         onlyfiles = [f for f in listdir(args['input']) if isfile(join(args['input'], f))]
@@ -443,7 +466,7 @@ def main():
                 print("Based on size, this is not a valid table. The file should be at least 8192 bytes, " + filename + " " + "is: " + str(file_size) + " bytes")
             else:
                 sys.stdout.write("\nReading from: " + filename + "\n")
-                parsing_loop(args['input'] + os.sep + filename, k, filename, output_dir, out_type)
+                parsing_loop(args['input'] + os.sep + filename, k, filename, output_dir, out_type, verify_checksums)
 
     logging.info("PostGrok has finished")
     return 0
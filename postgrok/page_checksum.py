@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#   Copyright 2017 FireEye, Inc. All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""Library to verify PostgreSQL data page checksums
+
+Clusters initialized with data checksums (initdb -k, PostgreSQL 9.3+) store
+a 16 bit checksum in pd_checksum (bytes 8-10 of the page header, where older
+releases kept pd_tli). The checksum is a FNV-1a derived hash computed over
+the whole 8192 byte page, mixed with the block number of the page. A page
+whose stored checksum matches is almost certainly a real PostgreSQL page, so
+this gives a far stronger page filter than the header range checks.
+
+NumPy is required to verify pages in bulk, install it with
+"pip install numpy" (or "pip install postgrok[checksum]")."""
+from __future__ import absolute_import
+from __future__ import division
+import re
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PAGE_SIZE = 8192
+RELSEG_SIZE = 131072 # blocks per 1GB relation segment file
+N_SUMS = 32 # number of parallel sums, the page is hashed as 64 rows of 32 words
+FNV_PRIME = 16777619
+PAGE_VERSION = 8196 # 8192 byte page, layout version 4
+
+CHECKSUM_BASE_OFFSETS = (
+    0x5B1F36E9, 0xB8525960, 0x02AB50AA, 0x1DE66D2A,
+    0x79FF467A, 0x9BB9F8A3, 0x217E7CD2, 0x83E13D2C,
+    0xF8D4474F, 0xE39EB970, 0x42C6AE16, 0x993216FA,
+    0x7B093B5D, 0x98DAFF3C, 0xF718902A, 0x0B1C9CDB,
+    0xE58F764B, 0x187636BC, 0x5D7B3BB1, 0xE73DE7DE,
+    0x92BEC979, 0xCCA6C0B2, 0x304A0979, 0x85AA43D4,
+    0x783125BB, 0x6CA8EAA2, 0xE407EAC6, 0x4B5CFC3E,
+    0x9FBF8C76, 0x15CA20BE, 0xF2CA9FDD, 0x3B3A1C2D,
+)
+
+
+def checksum_page(page, block_number):
+    """Function to compute the checksum of a single page in pure python,
+       mirrors pg_checksum_page() from PostgreSQL's checksum_impl.h
+       1. Treat pd_checksum as zero while hashing
+       2. Feed the page through 32 parallel FNV-1a style sums, followed by
+          two rounds of zeros to mix the final bits
+       3. XOR the sums together, XOR in the block number, and reduce the
+          result to 16 bits (the checksum is never 0)
+       Slow, but handy for checking a single page without NumPy."""
+    words = list(struct.unpack("<2048I", page[:PAGE_SIZE]))
+    words[2] &= 0xFFFF0000
+    sums = list(CHECKSUM_BASE_OFFSETS)
+    for i in range(0, len(words), N_SUMS):
+        for j in range(N_SUMS):
+            tmp = sums[j] ^ words[i + j]
+            sums[j] = ((tmp * FNV_PRIME) & 0xFFFFFFFF) ^ (tmp >> 17)
+    for i in range(2):
+        for j in range(N_SUMS):
+            tmp = sums[j]
+            sums[j] = ((tmp * FNV_PRIME) & 0xFFFFFFFF) ^ (tmp >> 17)
+    checksum = 0
+    for s in sums:
+        checksum ^= s
+    return ((checksum ^ block_number) % 65535) + 1
+
+
+def checksum_blocks(words):
+    """Function to compute the block checksum of many pages at once
+       1. words is a (pages, 2048) uint32 array holding one page per row,
+          pd_checksum must already be zeroed
+       2. Run the 32 sums of every page in lock step, one 32 word row at a
+          time, so the work is done in NumPy instead of per word in python
+       3. Returns the XOR of the sums for each page, before the block number
+          is mixed in, so several block numbers can be tried cheaply"""
+    prime = numpy.uint32(FNV_PRIME)
+    sums = numpy.tile(numpy.array(CHECKSUM_BASE_OFFSETS, dtype=numpy.uint32), (words.shape[0], 1))
+    for i in range(0, words.shape[1], N_SUMS):
+        tmp = sums ^ words[:, i:i + N_SUMS]
+        sums = (tmp * prime) ^ (tmp >> 17)
+    for i in range(2):
+        sums = (sums * prime) ^ (sums >> 17)
+    return numpy.bitwise_xor.reduce(sums, axis=1)
+
+
+def segment_block_offset(filename):
+    """Function to get the first block number of a relation segment file
+       Relations over 1GB are split into files named <relfilenode>.<segment>,
+       the block numbers used in the checksum count from the start of the
+       relation, not the start of the segment file. Anything else is assumed
+       to start at block 0."""
+    match = re.match(r"^\d+\.(\d+)$", filename)
+    if match:
+        return int(match.group(1)) * RELSEG_SIZE
+    return 0
+
+
+def verified_pages(file_to_parse, block_offset=0, batch_pages=1024):
+    """Generator that yields (position, page) for every page in a file whose
+       stored checksum verifies
+       1. Read the file in batches of pages, and view each batch as a
+          (pages, 2048) array of little endian words
+       2. Cheap structural check: the page size/version must be 8192/4 and
+          24 <= pd_lower <= pd_upper <= pd_special <= 8192. Real pages always
+          pass this, and it drops most noise before any hashing
+       3. Checksum the remaining pages in one go, and compare against
+          pd_checksum trying block numbers inferred from the page position:
+          - position in the file (plus block_offset for segment files), for
+            relation files or images of them
+          - position within the current run of consecutive sane pages, for
+            relation files copied contiguously into a larger image
+       4. Pages that fail are never yielded. Pages with no checksum stored
+          (pd_checksum == 0) always fail, so this is only useful for clusters
+          that had data checksums enabled"""
+    run_break = -1 # index of the last page that failed the structural check
+    first_page = 0
+    with open(file_to_parse, 'rb') as f:
+        while True:
+            data = f.read(PAGE_SIZE * batch_pages)
+            count = len(data) // PAGE_SIZE
+            if count == 0:
+                break
+            words = numpy.frombuffer(data[:count * PAGE_SIZE], dtype="<u4").reshape(count, PAGE_SIZE // 4).astype(numpy.uint32)
+            index = numpy.arange(first_page, first_page + count, dtype=numpy.int64)
+            first_page += count
+
+            lower = words[:, 3] & 0xFFFF
+            upper = words[:, 3] >> 16
+            special = words[:, 4] & 0xFFFF
+            version = words[:, 4] >> 16
+            sane = (version == PAGE_VERSION) & (lower >= 24) & (lower <= upper) & (upper <= special) & (special <= PAGE_SIZE)
+
+            last_break = numpy.maximum(run_break, numpy.maximum.accumulate(numpy.where(sane, -1, index)))
+            run_break = int(last_break[-1])
+            if not sane.any():
+                continue
+
+            words = words[sane]
+            index = index[sane]
+            run_block = index - last_break[sane] - 1
+
+            stored = words[:, 2] & 0xFFFF
+            words[:, 2] &= 0xFFFF0000
+            block_checksum = checksum_blocks(words).astype(numpy.int64)
+
+            verified = numpy.zeros(len(index), dtype=bool)
+            for block_number in (index + block_offset, run_block):
+                verified |= ((block_checksum ^ block_number) % 65535) + 1 == stored
+
+            for i in index[verified]:
+                page_start = (int(i) - first_page + count) * PAGE_SIZE
+                yield int(i) * PAGE_SIZE, data[page_start:page_start + PAGE_SIZE]
@@ -34,6 +34,9 @@ setup(
     },
     include_package_data=True,
     install_requires=requirements,
+    extras_require={
+        "checksum": ["numpy"],
+    },
     zip_safe=False,
     keywords='postgrok',
     classifiers=[